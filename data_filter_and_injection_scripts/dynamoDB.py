@@ -2,9 +2,12 @@
 import os
 import time
 import datetime
+import math
 import random
-from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 import boto3
 
 # ========= CONFIG =========
@@ -17,9 +20,13 @@ TABLE_NAME = "yelp-restaurants"
 LIMIT = 50
 MAX_OFFSET = 240 - LIMIT  # limit + offset <= 240
 OFFSETS = list(range(0, MAX_OFFSET + 1, LIMIT))  # [0, 50, 100, 150, 190]
-SLEEP_SEC = 0.25
-RETRY_429_SLEEP = 2.0
+FETCH_WORKERS = 5  # one worker per offset
 MAX_RETRIES = 3
+MAX_BACKOFF_SEC = 30
+
+# DynamoDB BatchWriteItem accepts at most 25 requests per call
+DDB_BATCH_SIZE = 25
+WRITE_WORKERS = 8
 
 # Manhattan-only filter parameters
 MANHATTAN_ZIP_PREFIXES = ("100", "101", "102")
@@ -32,33 +39,53 @@ YELP_API_KEY = os.getenv("YELP_API_KEY")
 assert YELP_API_KEY, "❌ Please set your Yelp API key: export YELP_API_KEY='your_key_here'"
 
 # AWS setup
-dynamodb = boto3.resource("dynamodb", region_name=REGION)
-table = dynamodb.Table(TABLE_NAME)
+ddb_client = boto3.client("dynamodb", region_name=REGION)
 
+# Shared HTTP session (keep-alive + connection pool across Yelp calls)
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=16))
 
-# ========= HELPERS =========
-def is_manhattan(biz):
-    """Strictly check if a business is in Manhattan based on ZIP or coordinates."""
-    loc = biz.get("location") or {}
-    zip_code = (loc.get("zip_code") or "").strip()
-
-    # ZIP-based filter: only 100xx, 101xx, 102xx
-    if not zip_code.startswith(MANHATTAN_ZIP_PREFIXES):
-        return False
 
-    # Coordinate-based filter (safety check)
-    coords = biz.get("coordinates") or {}
-    lat, lon = coords.get("latitude"), coords.get("longitude")
-    if lat is None or lon is None:
-        return False
-    try:
-        lat = float(lat)
-        lon = float(lon)
-    except (TypeError, ValueError):
-        return False
+# ========= HELPERS =========
+def manhattan_mask(businesses):
+    """Strictly check which businesses are in Manhattan based on ZIP and coordinates."""
+    coords = [b.get("coordinates") or {} for b in businesses]
+    # None -> NaN, and NaN fails every comparison below
+    lats = np.array([c.get("latitude") for c in coords], dtype=np.float64)
+    lons = np.array([c.get("longitude") for c in coords], dtype=np.float64)
 
     # Strict Manhattan bounding box
-    return (LAT_MIN <= lat <= LAT_MAX) and (LON_MIN <= lon <= LON_MAX)
+    in_box = (lats >= LAT_MIN) & (lats <= LAT_MAX) & (lons >= LON_MIN) & (lons <= LON_MAX)
+
+    # ZIP-based filter: only 100xx, 101xx, 102xx
+    zips = np.fromiter(
+        (((b.get("location") or {}).get("zip_code") or "").strip().startswith(MANHATTAN_ZIP_PREFIXES)
+         for b in businesses),
+        dtype=bool, count=len(businesses),
+    )
+    return in_box & zips
+
+
+def retry(send, retries=MAX_RETRIES):
+    """Call send() again on 429/5xx with exponential backoff + jitter, honoring Retry-After."""
+    for attempt in range(retries + 1):
+        resp = send()
+        if resp.status_code != 429 and resp.status_code < 500:
+            return resp
+        if attempt == retries:
+            break
+        try:
+            delay = float(resp.headers.get("Retry-After"))
+            if math.isnan(delay):
+                raise ValueError("Retry-After is NaN")
+            # Clamp: huge values stall the worker; negative/inf make time.sleep raise
+            delay = min(max(delay, 0), MAX_BACKOFF_SEC)
+        except (TypeError, ValueError):
+            # Jitter so parallel workers don't retry in lockstep
+            delay = min(2 ** attempt + random.random(), MAX_BACKOFF_SEC)
+        print(f"⚠️ HTTP {resp.status_code} (attempt {attempt + 1}) — retrying in {delay:.1f}s")
+        time.sleep(delay)
+    return resp
 
 
 def yelp_search(term, location, limit=50, offset=0):
@@ -75,87 +102,105 @@ def yelp_search(term, location, limit=50, offset=0):
         "categories": "restaurants"
     }
 
-    for attempt in range(1, MAX_RETRIES + 1):
-        resp = requests.get(url, headers=headers, params=params, timeout=20)
-        if resp.status_code == 200:
-            return resp.json()
-        elif resp.status_code == 429:
-            print(f"⚠️ Rate limited (attempt {attempt}) — retrying in {RETRY_429_SLEEP}s")
-            time.sleep(RETRY_429_SLEEP * attempt)
-        else:
-            print(f"Error {resp.status_code}: {resp.text}")
-            time.sleep(1)
+    resp = retry(lambda: SESSION.get(url, headers=headers, params=params, timeout=20))
+    if resp.status_code == 200:
+        return resp.json()
+    print(f"Error {resp.status_code}: {resp.text}")
     return {}
 
 
-def to_ddb_item(biz, cuisine):
-    """Convert Yelp business object to DynamoDB item."""
+def to_ddb_item(biz, cuisine, inserted_ts):
+    """Convert Yelp business object to a low-level (already marshalled) DynamoDB item."""
     loc = biz.get("location") or {}
     coords = biz.get("coordinates") or {}
 
     address = ", ".join(filter(None, [loc.get("address1"), loc.get("address2"), loc.get("address3")]))
-    inserted_ts = datetime.datetime.utcnow().isoformat(timespec="seconds") + "Z"
 
     return {
-        "BusinessID": biz["id"],
-        "Name": biz.get("name", ""),
-        "Address": address,
-        "City": loc.get("city", ""),
-        "State": loc.get("state", ""),
-        "ZipCode": loc.get("zip_code", ""),
-        "Coordinates": {
-            "lat": str(coords.get("latitude", "")),
-            "lon": str(coords.get("longitude", "")),
-        },
-        "NumReviews": Decimal(str(biz.get("review_count", 0))),
-        "Rating": Decimal(str(biz.get("rating", 0.0))),
-        "Cuisine": cuisine,
-        "InsertedAtTimestamp": inserted_ts,
+        "BusinessID": {"S": biz["id"]},
+        "Name": {"S": biz.get("name") or ""},
+        "Address": {"S": address},
+        "City": {"S": loc.get("city") or ""},
+        "State": {"S": loc.get("state") or ""},
+        "ZipCode": {"S": loc.get("zip_code") or ""},
+        "Coordinates": {"M": {
+            "lat": {"S": str(coords.get("latitude", ""))},
+            "lon": {"S": str(coords.get("longitude", ""))},
+        }},
+        "NumReviews": {"N": str(biz.get("review_count", 0))},
+        "Rating": {"N": str(biz.get("rating", 0.0))},
+        "Cuisine": {"S": cuisine},
+        "InsertedAtTimestamp": {"S": inserted_ts},
     }
 
 
+def _chunk(items, n=DDB_BATCH_SIZE):
+    """Yield successive n-sized chunks of items."""
+    for i in range(0, len(items), n):
+        yield items[i:i + n]
+
+
+def _write_chunk(chunk):
+    """BatchWriteItem one chunk, re-sending UnprocessedItems until all are stored."""
+    # Like table.batch_writer(), keep going until DynamoDB accepts every item;
+    # UnprocessedItems only signals throttling, real errors raise from the client.
+    request_items = {TABLE_NAME: [{"PutRequest": {"Item": it}} for it in chunk]}
+    attempt = 0
+    while request_items:
+        if attempt:
+            left = len(request_items.get(TABLE_NAME, []))
+            print(f"⚠️ {left} items unprocessed (attempt {attempt}) — retrying")
+            time.sleep(min(2 ** attempt + random.random(), MAX_BACKOFF_SEC))
+        resp = ddb_client.batch_write_item(RequestItems=request_items)
+        request_items = resp.get("UnprocessedItems") or {}
+        attempt += 1
+
+
 def batch_write(items):
     """Write multiple items to DynamoDB efficiently."""
     if not items:
         return
-    with table.batch_writer(overwrite_by_pkeys=["BusinessID"]) as batch:
-        for item in items:
-            batch.put_item(Item=item)
+    with ThreadPoolExecutor(max_workers=WRITE_WORKERS) as ex:
+        list(ex.map(_write_chunk, _chunk(items)))
 
 
 def collect_for_cuisine(cuisine):
     """Collect and store ~200 restaurants for one cuisine."""
     print(f"\n🍽 Collecting {TARGET_PER_CUISINE} {cuisine} restaurants...")
-    have = {}
+    have = set()
     total_added = 0
-
-    for off in OFFSETS:
-        term = f"{cuisine} restaurants"
-        data = yelp_search(term=term, location=LOCATION, limit=LIMIT, offset=off)
-        businesses = data.get("businesses") or []
-        if not businesses:
+    # One timestamp for the whole batch, e.g. 2025-10-09T19:00:00Z
+    inserted_ts = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z")
+
+    # Fetch all offsets concurrently, then filter and merge on this thread
+    term = f"{cuisine} restaurants"
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as ex:
+        pages = list(ex.map(
+            lambda off: yelp_search(term=term, location=LOCATION, limit=LIMIT, offset=off),
+            OFFSETS,
+        ))
+
+    businesses = [biz for data in pages for biz in (data.get("businesses") or [])]
+    if not businesses:
+        print(f"✅ Finished {cuisine}: 0 restaurants stored.")
+        return 0
+
+    new_items = []
+    for biz, in_manhattan in zip(businesses, manhattan_mask(businesses)):
+        if not in_manhattan:
             continue
-
-        new_items = []
-        for biz in businesses:
-            if not is_manhattan(biz):
-                continue
-            bid = biz["id"]
-            if bid in have:
-                continue
-            have[bid] = True
-            new_items.append(to_ddb_item(biz, cuisine))
-            total_added += 1
-            if total_added >= TARGET_PER_CUISINE:
-                break
-
-        if new_items:
-            batch_write(new_items)
-            print(f"  ✅ Added {len(new_items)} (total {total_added})")
-
+        bid = biz["id"]
+        if bid in have:
+            continue
+        have.add(bid)
+        new_items.append(to_ddb_item(biz, cuisine, inserted_ts))
+        total_added += 1
         if total_added >= TARGET_PER_CUISINE:
             break
-        time.sleep(SLEEP_SEC)
+
+    if new_items:
+        batch_write(new_items)
+        print(f"  ✅ Added {len(new_items)} (total {total_added})")
 
     print(f"✅ Finished {cuisine}: {total_added} restaurants stored.")
     return total_added
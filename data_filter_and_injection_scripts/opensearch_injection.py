@@ -1,76 +1,165 @@
 #!/usr/bin/env python3
-import json
-import urllib3
-import urllib.parse
+import queue
+import threading
+from contextlib import closing
 from decimal import Decimal
 import boto3
+import orjson
 from botocore.session import Session
-from botocore.awsrequest import AWSRequest
-from botocore.auth import SigV4Auth
+from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth, JSONSerializer
+from opensearchpy.helpers import parallel_bulk
 
 REGION = "us-east-1"
 SERVICE = "es"
 OS_ENDPOINT = "https://search-opensearchdinning-id7jzgvfbjqqpobndub2h3h4am.aos.us-east-1.on.aws"
+OS_INDEX = "restaurants"
 DDB_TABLE = "yelp-restaurants"
-BATCH_SIZE = 500
 
-http = urllib3.PoolManager()
-creds = Session().get_credentials().get_frozen_credentials()
+# parallel_bulk tuning: splits on whichever of doc count / request bytes is hit first
+BULK_THREADS = 8
+BULK_CHUNK_SIZE = 1000
+BULK_MAX_CHUNK_BYTES = 10 * 1024 * 1024
+BULK_QUEUE_SIZE = 4
 
+# DynamoDB parallel scan fan-out
+SCAN_SEGMENTS = 4
 
-def es_bulk(lines):
-    url = OS_ENDPOINT + "/_bulk"
-    headers = {
-        "Host": urllib.parse.urlparse(OS_ENDPOINT).netloc,
-        "Content-Type": "application/x-ndjson"
-    }
-    data = ("\n".join(lines) + "\n").encode("utf-8")
-    req = AWSRequest(method="POST", url=url, data=data, headers=headers)
-    SigV4Auth(creds, SERVICE, REGION).add_auth(req)
-    r = http.request("POST", url, body=data, headers=dict(req.headers))
-    print("_bulk ->", r.status, r.data.decode()[:200])
+
+def _orjson_default(o):
+    if isinstance(o, Decimal):
+        return float(o)
+    raise TypeError(f"Unserializable type: {type(o).__name__}")
+
+
+class OrjsonSerializer(JSONSerializer):
+    """Serialize bulk action/source lines with orjson instead of the stdlib."""
+
+    def dumps(self, data):
+        if isinstance(data, str):
+            return data
+        return orjson.dumps(data, default=_orjson_default).decode("utf-8")
 
 
-ddb = boto3.resource("dynamodb", region_name=REGION)
-table = ddb.Table(DDB_TABLE)
+creds = Session().get_credentials()
+client = OpenSearch(
+    hosts=[OS_ENDPOINT],
+    http_auth=AWSV4SignerAuth(creds, REGION, SERVICE),
+    use_ssl=True,
+    verify_certs=True,
+    connection_class=RequestsHttpConnection,
+    pool_maxsize=BULK_THREADS,
+    serializer=OrjsonSerializer(),
+)
 
 
-def scan_all():
-    items = []
-    scan_kwargs = {"ProjectionExpression": "BusinessID, Cuisine"}
+_SEGMENT_DONE = object()
+
+
+def scan_segment(seg, total):
+    """Yield scan pages for one segment of a parallel DynamoDB scan."""
+    # boto3 resources aren't thread-safe, so each segment gets its own
+    table = boto3.session.Session().resource("dynamodb", region_name=REGION).Table(DDB_TABLE)
+    scan_kwargs = {
+        "ProjectionExpression": "BusinessID, Cuisine, #n, Address",
+        "ExpressionAttributeNames": {"#n": "Name"},  # Name is a reserved word
+        "TotalSegments": total,
+        "Segment": seg,
+    }
     while True:
         r = table.scan(**scan_kwargs)
-        items.extend(r.get("Items", []))
+        yield r.get("Items", [])
         if "LastEvaluatedKey" in r:
             scan_kwargs["ExclusiveStartKey"] = r["LastEvaluatedKey"]
         else:
             break
-    return items
 
 
-if __name__ == "__main__":
-    items = scan_all()
-    print("Scanned:", len(items))
+def scan_all(total=SCAN_SEGMENTS):
+    """Stream items from a parallel scan as pages arrive from each segment."""
+    # Bounded so at most ~one page per segment is buffered at a time
+    pages = queue.Queue(maxsize=total)
+    # Set when the consumer stops (done, closed early, or raised) so workers don't block forever
+    stop = threading.Event()
+    errors = []
 
-    batch = []
-    indexed = 0
+    def put(item):
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def worker(seg):
+        try:
+            for page in scan_segment(seg, total):
+                if not put(page):
+                    return
+        except Exception as e:
+            errors.append(e)
+        finally:
+            put(_SEGMENT_DONE)
+
+    # Daemon threads, so a scan whose generator is never closed can't block interpreter exit
+    threads = [threading.Thread(target=worker, args=(seg,), daemon=True) for seg in range(total)]
+    for t in threads:
+        t.start()
+    try:
+        remaining = total
+        while remaining:
+            page = pages.get()
+            if page is _SEGMENT_DONE:
+                remaining -= 1
+                continue
+            yield from page
+    finally:
+        stop.set()
+        while True:  # unblock any worker waiting on a full queue
+            try:
+                pages.get_nowait()
+            except queue.Empty:
+                break
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]  # re-raise any scan error
+
+
+def actions_gen(items):
+    """Yield one bulk index action per DynamoDB item."""
     for it in items:
         rid = it.get("BusinessID")
         cuisine = it.get("Cuisine")
         if not rid or not cuisine:
             continue
-        batch.append(json.dumps({"index": {"_index": "restaurants", "_id": str(rid)}}))
-        batch.append(json.dumps(
-            {"restaurant_id": str(rid), "cuisine": str(cuisine)},
-            default=lambda o: float(o) if isinstance(o, Decimal) else o
-        ))
-        if len(batch) >= BATCH_SIZE * 2:
-            es_bulk(batch)
-            indexed += len(batch) // 2
-            batch = []
-
-    if batch:
-        es_bulk(batch)
-        indexed += len(batch) // 2
+        yield {
+            "_index": OS_INDEX,
+            "_id": str(rid),
+            "_source": {
+                "restaurant_id": str(rid),
+                "cuisine": str(cuisine),
+                "name": it.get("Name", ""),
+                "address": it.get("Address", ""),
+            },
+        }
+
+
+if __name__ == "__main__":
+    indexed = 0
+    with closing(scan_all()) as items:
+        for ok, info in parallel_bulk(
+            client,
+            actions_gen(items),
+            thread_count=BULK_THREADS,
+            chunk_size=BULK_CHUNK_SIZE,
+            max_chunk_bytes=BULK_MAX_CHUNK_BYTES,
+            queue_size=BULK_QUEUE_SIZE,
+            raise_on_error=False,
+        ):
+            if ok:
+                indexed += 1
+            else:
+                print("_bulk item failed ->", info)
 
     print("Indexed docs:", indexed)
@@ -2,11 +2,21 @@ import json
 import datetime
 import uuid
 import boto3
+from botocore.config import Config
 import traceback
 import os
 
+# Shared client config: keep-alive, larger pool, adaptive client-side retries.
+# Read timeouts are set per client to fit each API's latency.
+CFG = Config(
+    retries={"mode": "adaptive", "max_attempts": 5},
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    connect_timeout=1,
+)
+
 # Initialize Lex client
-lex_client = boto3.client("lexv2-runtime", region_name="us-east-1")
+lex_client = boto3.client("lexv2-runtime", region_name="us-east-1", config=CFG.merge(Config(read_timeout=10)))
 
 # Environment variables
 BOT_ID = os.environ.get("LEX_BOT_ID")
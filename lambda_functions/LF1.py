@@ -1,13 +1,24 @@
 import json
+import re
 import boto3
-from datetime import datetime
+from botocore.config import Config
+from datetime import date
 
 # ----------- AWS clients ----------- #
-sqs = boto3.client('sqs', region_name='us-east-1')
+CFG = Config(
+    retries={'mode': 'adaptive', 'max_attempts': 5},
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    connect_timeout=1,
+)
+sqs = boto3.client('sqs', region_name='us-east-1', config=CFG.merge(Config(read_timeout=5)))
 QUEUE_URL = "https://sqs.us-east-1.amazonaws.com/244086559221/Dining-Email"
 
 # ----------- Constants ----------- #
 ALLOWED_CUISINES = ["Italian", "Chinese", "Mexican", "Indian", "Japanese"]
+_ALLOWED = frozenset(c.lower() for c in ALLOWED_CUISINES)
+_EMAIL_RE = re.compile(r"[^@\s]+@[^@\s]+\.[^@\s]+")
+_TIME_RE = re.compile(r"([01]\d|2[0-3]):[0-5]\d")
 
 # ----------- Helper Functions ----------- #
 def push_to_sqs(data):
@@ -66,7 +77,7 @@ def get_slot_value(slots, slot_name):
 
 # ----------- Validation Functions ----------- #
 def is_valid_email(email):
-    return email and "@" in email
+    return bool(email and _EMAIL_RE.fullmatch(email))
 
 def is_valid_number(num):
     try:
@@ -75,25 +86,16 @@ def is_valid_number(num):
         return False
 
 def is_valid_cuisine(cuisine):
-    try:
-        cuisine = cuisine.strip().capitalize()
-        return cuisine in ALLOWED_CUISINES
-    except:
-        return False
+    return bool(cuisine) and cuisine.strip().lower() in _ALLOWED
 
 def is_valid_date(date_str):
     try:
-        date_obj = datetime.strptime(date_str, "%Y-%m-%d")
-        return date_obj.date() >= datetime.today().date()
-    except:
+        return date.fromisoformat(date_str) >= date.today()
+    except (TypeError, ValueError):
         return False
 
 def is_valid_time(time_str):
-    try:
-        datetime.strptime(time_str, "%H:%M")
-        return True
-    except:
-        return False
+    return bool(time_str and _TIME_RE.fullmatch(time_str))
 
 # ----------- Lambda Handler ----------- #
 def lambda_handler(event, context):
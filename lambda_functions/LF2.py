@@ -1,231 +1,391 @@
-import os, json, random, logging
-import boto3
-from botocore.session import Session
-from botocore.awsrequest import AWSRequest
-from botocore.auth import SigV4Auth
-from botocore.exceptions import ClientError
-import urllib.parse
-import urllib3
-from datetime import datetime
-
-
-logging.getLogger().setLevel(logging.INFO)
-
-REGION       = os.getenv("REGION", "us-east-1")
-QUEUE_URL    = os.environ["QUEUE_URL"]
-DDB_TABLE    = os.environ["DDB_TABLE"]
-OS_ENDPOINT  = os.environ["OS_ENDPOINT"].rstrip("/")
-OS_INDEX     = os.environ["OS_INDEX"]
-SES_FROM     = os.environ["SES_FROM"]
-NUM_RESULTS  = int(os.getenv("NUM_RESULTS", "3"))
-
-sqs = boto3.client("sqs", region_name=REGION)
-ddb = boto3.client("dynamodb", region_name=REGION)
-ses = boto3.client("ses", region_name=REGION)
-
-http = urllib3.PoolManager()
-credentials = Session().get_credentials().get_frozen_credentials()
-
-def os_signed_request(method, path, body=None, params=None):
-    """SigV4-signed HTTP request to OpenSearch without extra deps."""
-    if params:
-        qs = urllib.parse.urlencode(params)
-        url = f"{OS_ENDPOINT}{path}?{qs}"
-    else:
-        url = f"{OS_ENDPOINT}{path}"
-    headers = {"Host": urllib.parse.urlparse(OS_ENDPOINT).netloc, "Content-Type": "application/json"}
-    data = body if isinstance(body, (str, bytes)) else (json.dumps(body) if body is not None else None)
-    req = AWSRequest(method=method, url=url, data=data, headers=headers)
-    SigV4Auth(credentials, "es", REGION).add_auth(req)
-    r = http.request(method, url, body=data, headers=dict(req.headers))
-    if r.status not in (200, 201):
-        raise RuntimeError(f"OpenSearch {r.status}: {r.data.decode('utf-8','ignore')}")
-    return json.loads(r.data)
-
-def os_random_ids_by_cuisine(cuisine, size):
-    # Use function_score + random_score to randomize
-    q = {
-      "size": size,
-      "query": {
-        "function_score": {
-          "query": { "term": { "cuisine": cuisine } },
-          "random_score": {}
-        }
-      }
-    }
-    res = os_signed_request("POST", f"/{OS_INDEX}/_search", body=q)
-    hits = res.get("hits", {}).get("hits", [])
-    ids = []
-    for h in hits:
-        src = h.get("_source") or {}
-        rid = src.get("restaurant_id") or h.get("_id")
-        if rid:
-            ids.append(rid)
-    return ids
-
-def ddb_get_many(business_ids):
-    if not business_ids:
-        return {}
-
-    keys = [{"BusinessID": {"S": bid}} for bid in business_ids]
-
-    res = ddb.batch_get_item(
-        RequestItems={
-            DDB_TABLE: {
-                "Keys": keys,
-                "ProjectionExpression": "BusinessID, #n, Address",
-                "ExpressionAttributeNames": {"#n": "Name"}
-            }
-        }
-    )
-
-    out = {}
-    for item in res.get("Responses", {}).get(DDB_TABLE, []):
-        def g(d, k, t): return d.get(k, {}).get(t)
-
-        bid = g(item, "BusinessID", "S")
-        name = g(item, "Name", "S")
-        addr = g(item, "Address", "S")
-
-        out[bid] = {"BusinessID": bid, "Name": name, "Address": addr}
-
-    return out
-
-def format_email(body):
-    # --- Build the intro line ---
-    intro = f"Hello! Here are my {body['cuisine'].title()} restaurant suggestions"
-
-    if body.get("partySize"):
-        intro += f" for {body['partySize']} people"
-
-    # --- Date and time formatting ---
-    when_parts = []
-    if body.get("date"):
-        try:
-            date_obj = datetime.strptime(body["date"], "%Y-%m-%d")
-            when_parts.append(date_obj.strftime("%A, %B %-d, %Y"))  # e.g., Thursday, October 9, 2025
-        except ValueError:
-            when_parts.append(body["date"])
-
-    if body.get("time"):
-        try:
-            # Convert 24-hour (e.g. "19:00") to 12-hour (e.g. "7 pm")
-            time_obj = datetime.strptime(body["time"], "%H:%M")
-            formatted_time = time_obj.strftime("%-I %p").lower()
-            when_parts.append(f"at {formatted_time}")
-        except ValueError:
-            when_parts.append(f"at {body['time']}")  # fallback if format is weird
-
-    if when_parts:
-        intro += f", for {' '.join(when_parts)}"
-
-    intro += ":"
-
-    # --- Add restaurant lines ---
-    lines = [intro]
-    for i, r in enumerate(body.get("results", []), start=1):
-        piece = f"{i}. {r['Name']}"
-        if r.get("Address"):
-            piece += f", located at {r['Address']}"
-        lines.append(piece)
-
-    lines.append("\nEnjoy your meal!")
-
-    return "\n".join(lines)
-
-def send_email(to_addr, subject, text):
-    try:
-        response = ses.send_email(
-            Source=SES_FROM,
-            Destination={"ToAddresses": [to_addr]},
-            Message={
-                "Subject": {"Data": subject},
-                "Body": {"Text": {"Data": text}}
-            }
-        )
-        print("Email sent! Message ID:", response["MessageId"])
-        return True
-    except ClientError as e:
-        print("SES failed:", e.response['Error']['Message'])
-        return False
-
-
-def process_one_message(msg):
-    body_raw = msg.get("Body") or "{}"
-    try:
-        payload = json.loads(body_raw)
-    except Exception:
-        logging.error("Bad SQS body: %s", body_raw)
-        return False  # transient failure → retry → eventually DLQ
-
-    cuisine = (payload.get("cuisine") or "").strip().lower()
-    email   = (payload.get("email") or "").strip()
-    if not cuisine or not email:
-        logging.warning("Missing cuisine or email: %s", payload)
-        return True  # discard bad message to avoid poison
-
-    # 1) Random IDs from OpenSearch
-    try:
-        ids = os_random_ids_by_cuisine(cuisine, NUM_RESULTS * 2)
-    except Exception as e:
-        logging.error("OpenSearch failed: %s", e)
-        return False  # transient failure → retry → eventually DLQ
-
-    ids = list(dict.fromkeys(ids))[:NUM_RESULTS]
-    if not ids:
-        logging.warning("No hits in OpenSearch for cuisine=%s", cuisine)
-        return True  # safe to delete
-
-    # # 2) Details from DynamoDB
-    try:
-        details = ddb_get_many(ids)
-    except Exception as e:
-        logging.error("DynamoDB failed: %s", e)
-        return False  # transient failure → retry → eventually DLQ
-
-    results = [details[i] for i in ids if i in details]
-    if not results:
-        logging.warning("No DynamoDB matches for %s", ids)
-        return True  # safe to delete
-
-    # # 3) Email
-    enriched = {
-        "cuisine": cuisine,
-        "partySize": payload.get("num_people"),
-        "date": payload.get("dining_date"),
-        "time": payload.get("dining_time"),
-        "results": results
-    }
-    subject = f"{cuisine.title()} restaurant suggestions"
-    text = format_email(enriched)
-
-    sent = send_email(email, subject, text)
-    if sent:
-        logging.info("Sent suggestions to %s", email)
-        return True
-    else:
-        logging.error("Failed to send email for %s", email)
-        return False
-
-def lambda_handler(event, context):
-    # Pull up to 10 msgs per run
-    resp = sqs.receive_message(
-        QueueUrl=QUEUE_URL, MaxNumberOfMessages=10,
-        VisibilityTimeout=30, WaitTimeSeconds=3
-    )
-    msgs = resp.get("Messages", [])
-
-    if not msgs:
-        return {"ok": True, "processed": 0}
-
-    processed = 0
-    for m in msgs:
-        ok = False
-        try:
-            ok = process_one_message(m)
-        except Exception as e:
-            logging.exception("Processing failed: %s", e)
-        if ok:
-            sqs.delete_message(QueueUrl=QUEUE_URL, ReceiptHandle=m["ReceiptHandle"])
-            processed += 1
-    return {"ok": True, "processed": processed}
+import os, json, random, logging, time
+import hashlib, hmac
+import orjson
+from functools import lru_cache
+import boto3
+from botocore.config import Config
+from botocore.session import Session
+from botocore.exceptions import ClientError
+import urllib.parse
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone, time as dt_time
+
+
+logging.getLogger().setLevel(logging.INFO)
+
+REGION       = os.getenv("REGION", "us-east-1")
+QUEUE_URL    = os.environ["QUEUE_URL"]
+OS_ENDPOINT  = os.environ["OS_ENDPOINT"].rstrip("/")
+OS_INDEX     = os.environ["OS_INDEX"]
+SES_FROM     = os.environ["SES_FROM"]
+NUM_RESULTS  = int(os.getenv("NUM_RESULTS", "3"))
+POOL_SIZE    = int(os.getenv("POOL_SIZE", "100"))
+POOL_TTL_SEC = int(os.getenv("POOL_TTL_SEC", "300"))
+SES_TEMPLATE = os.getenv("SES_TEMPLATE", "RestaurantSuggestions")
+SES_BULK_MAX = 50  # SendBulkTemplatedEmail destination limit
+
+_DATE_FMT = "%A, %B %-d, %Y"  # e.g., Thursday, October 9, 2025
+_TIME_FMT = "%-I %p"          # e.g., 7 PM
+
+# Clients live at module scope so warm invocations reuse their connections.
+# Read timeouts are set per client to fit each API's latency.
+CFG = Config(
+    retries={"mode": "adaptive", "max_attempts": 5},
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    connect_timeout=1,
+)
+SQS_WAIT_SEC = 20  # max long poll
+# botocore doesn't stretch the socket timeout for long polls, so it must exceed the wait
+sqs = boto3.client("sqs", region_name=REGION, config=CFG.merge(Config(read_timeout=SQS_WAIT_SEC + 5)))
+ses = boto3.client("ses", region_name=REGION, config=CFG.merge(Config(read_timeout=10)))
+
+# HTTP/2 multiplexes concurrent OpenSearch calls over one TLS connection
+http = httpx.Client(
+    timeout=20,
+    transport=httpx.HTTPTransport(
+        http2=True,
+        limits=httpx.Limits(max_connections=32),
+        retries=3,  # connect-level retries; 429/503 are retried in os_signed_request
+    ),
+)
+OS_RETRY_STATUS = (429, 503)
+OS_MAX_RETRIES = 3
+credentials = Session().get_credentials().get_frozen_credentials()
+
+OS_HOST = urllib.parse.urlparse(OS_ENDPOINT).netloc
+
+def _hmac(key, msg):
+    return hmac.new(key, msg.encode("utf-8"), hashlib.sha256).digest()
+
+@lru_cache(maxsize=2)
+def _signing_key(date_stamp):
+    """SigV4 kDate -> kRegion -> kService -> kSigning; only changes once per UTC day."""
+    k = _hmac(("AWS4" + credentials.secret_key).encode("utf-8"), date_stamp)
+    k = _hmac(k, REGION)
+    k = _hmac(k, "es")
+    return _hmac(k, "aws4_request")
+
+def _sigv4_headers(method, path, payload, content_type="application/json"):
+    """Build SigV4 headers for an OpenSearch request using the cached signing key.
+
+    Only handles what LF2 sends: no query string, plain ASCII paths, fixed header values.
+    """
+    amz_date = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    date_stamp = amz_date[:8]
+    payload_hash = hashlib.sha256(payload or b"").hexdigest()
+
+    headers = {
+        "content-type": content_type,
+        "host": OS_HOST,
+        "x-amz-content-sha256": payload_hash,
+        "x-amz-date": amz_date,
+    }
+    if credentials.token:
+        headers["x-amz-security-token"] = credentials.token
+
+    signed_headers = ";".join(sorted(headers))
+    canonical_headers = "".join(f"{k}:{headers[k]}\n" for k in sorted(headers))
+    canonical_request = "\n".join([
+        method, urllib.parse.quote(path, safe="/~"), "",
+        canonical_headers, signed_headers, payload_hash,
+    ])
+    scope = f"{date_stamp}/{REGION}/es/aws4_request"
+    string_to_sign = "\n".join([
+        "AWS4-HMAC-SHA256", amz_date, scope,
+        hashlib.sha256(canonical_request.encode("utf-8")).hexdigest(),
+    ])
+    signature = hmac.new(_signing_key(date_stamp), string_to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+    headers["Authorization"] = (
+        f"AWS4-HMAC-SHA256 Credential={credentials.access_key}/{scope}, "
+        f"SignedHeaders={signed_headers}, Signature={signature}"
+    )
+    return headers
+
+def os_signed_request(method, path, body=None, content_type="application/json"):
+    """SigV4-signed HTTP request to OpenSearch."""
+    url = f"{OS_ENDPOINT}{path}"
+    data = body if isinstance(body, (str, bytes)) else (orjson.dumps(body) if body is not None else None)
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    for attempt in range(OS_MAX_RETRIES + 1):
+        # Re-sign each attempt so x-amz-date stays current
+        headers = _sigv4_headers(method, path, data, content_type)
+        r = http.request(method, url, content=data, headers=headers)
+        if r.status_code not in OS_RETRY_STATUS or attempt == OS_MAX_RETRIES:
+            break
+        time.sleep(0.5 * 2 ** attempt)
+    if r.status_code not in (200, 201):
+        raise RuntimeError(f"OpenSearch {r.status_code}: {r.content.decode('utf-8','ignore')}")
+    return orjson.loads(r.content)
+
+def _random_query(cuisine, size):
+    # Use function_score + random_score to randomize.
+    # Name/Address are denormalized into the index, so no DynamoDB lookup is needed.
+    return {
+      "size": size,
+      "_source": ["restaurant_id", "name", "address"],
+      "query": {
+        "function_score": {
+          "query": { "term": { "cuisine": cuisine } },
+          "random_score": {}
+        }
+      }
+    }
+
+def _hits_to_restaurants(res):
+    hits = res.get("hits", {}).get("hits", [])
+    out = []
+    for h in hits:
+        src = h.get("_source") or {}
+        rid = src.get("restaurant_id") or h.get("_id")
+        if rid:
+            out.append({"BusinessID": rid, "Name": src.get("name"), "Address": src.get("address")})
+    return out
+
+def os_random_restaurants_by_cuisine(cuisine, size):
+    res = os_signed_request("POST", f"/{OS_INDEX}/_search", body=_random_query(cuisine, size))
+    return _hits_to_restaurants(res)
+
+def os_msearch_restaurants(cuisines, size):
+    """Random restaurants for several cuisines in one _msearch; failed sub-searches are omitted."""
+    lines = []
+    for c in cuisines:
+        lines.append(b"{}")
+        lines.append(orjson.dumps(_random_query(c, size)))
+    body = b"\n".join(lines) + b"\n"
+    res = os_signed_request("POST", f"/{OS_INDEX}/_msearch", body=body,
+                            content_type="application/x-ndjson")
+    out = {}
+    for c, r in zip(cuisines, res.get("responses", [])):
+        if "error" in r:
+            logging.error("OpenSearch _msearch failed for cuisine=%s: %s", c, r["error"])
+            continue
+        out[c] = _hits_to_restaurants(r)
+    return out
+
+# cuisine -> (fetched_at, restaurants); survives across warm invocations
+_POOL_CACHE = {}
+
+def _pool_is_fresh(cuisine):
+    cached = _POOL_CACHE.get(cuisine)
+    return cached is not None and time.monotonic() - cached[0] <= POOL_TTL_SEC
+
+def _cache_pool(cuisine, hits):
+    pool = list({r["BusinessID"]: r for r in hits if r.get("Name")}.values())
+    if hits and not pool:
+        # Index predates the name/address denormalization; keep the message for retry
+        raise RuntimeError(
+            f"OpenSearch hits for cuisine={cuisine} have no name; re-run opensearch_injection.py"
+        )
+    # Empty pools are cached too, so a cuisine with no hits costs one query per TTL
+    _POOL_CACHE[cuisine] = (time.monotonic(), pool)
+    return pool
+
+def prefetch_pools(cuisines):
+    """Refresh every stale cuisine pool with a single _msearch request."""
+    stale = [c for c in dict.fromkeys(cuisines) if c and not _pool_is_fresh(c)]
+    if not stale:
+        return
+    for c, hits in os_msearch_restaurants(stale, POOL_SIZE).items():
+        try:
+            _cache_pool(c, hits)
+        except RuntimeError as e:
+            logging.error("%s", e)  # one bad cuisine shouldn't skip caching the rest
+
+def get_restaurants(cuisine):
+    """Sample NUM_RESULTS restaurants from a cached per-cuisine pool, refreshed every POOL_TTL_SEC."""
+    if _pool_is_fresh(cuisine):
+        pool = _POOL_CACHE[cuisine][1]
+    else:
+        pool = _cache_pool(cuisine, os_random_restaurants_by_cuisine(cuisine, POOL_SIZE))
+    return random.sample(pool, k=min(NUM_RESULTS, len(pool)))
+
+@lru_cache(maxsize=512)
+def _fmt_date(iso):
+    try:
+        return date.fromisoformat(iso).strftime(_DATE_FMT)
+    except ValueError:
+        return iso
+
+@lru_cache(maxsize=512)
+def _fmt_time(iso):
+    # Convert 24-hour (e.g. "19:00") to 12-hour (e.g. "7 pm")
+    try:
+        return dt_time.fromisoformat(iso).strftime(_TIME_FMT).lower()
+    except ValueError:
+        return iso  # fallback if format is weird
+
+def format_email(body):
+    # --- Build the intro line ---
+    intro = f"Hello! Here are my {body['cuisine'].title()} restaurant suggestions"
+
+    if body.get("partySize"):
+        intro += f" for {body['partySize']} people"
+
+    # --- Date and time formatting ---
+    # LF1 already validated these as ISO YYYY-MM-DD / HH:MM
+    when_parts = []
+    if body.get("date"):
+        when_parts.append(_fmt_date(body["date"]))
+
+    if body.get("time"):
+        when_parts.append(f"at {_fmt_time(body['time'])}")
+
+    if when_parts:
+        intro += f", for {' '.join(when_parts)}"
+
+    # --- Add restaurant lines ---
+    lines = [
+        f"{i}. {r['Name']}" + (f", located at {r['Address']}" if r.get("Address") else "")
+        for i, r in enumerate(body.get("results", []), start=1)
+    ]
+
+    return "\n".join([intro + ":", *lines, "\nEnjoy your meal!"])
+
+def _send_bulk_chunk(chunk):
+    """One SendBulkTemplatedEmail call; returns one bool per email in chunk."""
+    try:
+        response = ses.send_bulk_templated_email(
+            Source=SES_FROM,
+            Template=SES_TEMPLATE,
+            DefaultTemplateData=json.dumps({"cuisine": "Restaurant", "restaurants": ""}),
+            Destinations=[
+                {
+                    "Destination": {"ToAddresses": [e["to"]]},
+                    "ReplacementTemplateData": json.dumps(
+                        {"cuisine": e["cuisine"], "restaurants": e["text"]}
+                    ),
+                }
+                for e in chunk
+            ],
+        )
+    except ClientError as err:
+        if len(chunk) > 1:
+            # A request-level rejection (e.g. an unverified recipient in the SES
+            # sandbox) fails the whole call; split so only the bad address fails.
+            mid = len(chunk) // 2
+            return _send_bulk_chunk(chunk[:mid]) + _send_bulk_chunk(chunk[mid:])
+        logging.error("SES failed for %s: %s", chunk[0]["to"], err.response['Error']['Message'])
+        return [False]
+
+    statuses = response.get("Status", [])
+    sent = []
+    for i, e in enumerate(chunk):
+        status = statuses[i] if i < len(statuses) else {}
+        ok = status.get("Status") == "Success"
+        if ok:
+            logging.info("Sent suggestions to %s (Message ID %s)", e["to"], status.get("MessageId"))
+        else:
+            logging.error("Failed to send email for %s: %s", e["to"], status.get("Error"))
+        sent.append(ok)
+    return sent
+
+def send_bulk_emails(emails):
+    """Send prepared emails via the SES template, 50 destinations per call.
+
+    Returns one bool per email, in order, for whether SES accepted it.
+    """
+    sent = []
+    for i in range(0, len(emails), SES_BULK_MAX):
+        sent.extend(_send_bulk_chunk(emails[i:i + SES_BULK_MAX]))
+    return sent
+
+
+def parse_body(msg):
+    """Decode an SQS message body, or return None if it isn't valid JSON."""
+    body_raw = msg.get("Body") or "{}"
+    try:
+        return json.loads(body_raw)
+    except Exception:
+        logging.error("Bad SQS body: %s", body_raw)
+        return None
+
+def process_one_message(payload):
+    """Return (ok, email): email is the prepared message to send, or None if nothing to send."""
+    if payload is None:
+        return False, None  # transient failure → retry → eventually DLQ
+
+    cuisine = (payload.get("cuisine") or "").strip().lower()
+    email   = (payload.get("email") or "").strip()
+    if not cuisine or not email:
+        logging.warning("Missing cuisine or email: %s", payload)
+        return True, None  # discard bad message to avoid poison
+
+    # 1) Random restaurants (with details) from the cached OpenSearch pool
+    try:
+        results = get_restaurants(cuisine)
+    except Exception as e:
+        logging.error("OpenSearch failed: %s", e)
+        return False, None  # transient failure → retry → eventually DLQ
+
+    if not results:
+        logging.warning("No hits in OpenSearch for cuisine=%s", cuisine)
+        return True, None  # safe to delete
+
+    # # 2) Email (sent in bulk by the handler)
+    enriched = {
+        "cuisine": cuisine,
+        "partySize": payload.get("num_people"),
+        "date": payload.get("dining_date"),
+        "time": payload.get("dining_time"),
+        "results": results
+    }
+    return True, {"to": email, "cuisine": cuisine.title(), "text": format_email(enriched)}
+
+def _safe_process(msg, payload):
+    """Run process_one_message, treating any exception as a failure."""
+    try:
+        return (msg, *process_one_message(payload))
+    except Exception as e:
+        logging.exception("Processing failed: %s", e)
+        return msg, False, None
+
+def lambda_handler(event, context):
+    # Pull up to 10 msgs per run
+    resp = sqs.receive_message(
+        QueueUrl=QUEUE_URL, MaxNumberOfMessages=10,
+        VisibilityTimeout=30, WaitTimeSeconds=SQS_WAIT_SEC
+    )
+    msgs = resp.get("Messages", [])
+
+    if not msgs:
+        return {"ok": True, "processed": 0}
+
+    payloads = [parse_body(m) for m in msgs]
+
+    # Warm all stale cuisine pools with one _msearch; on failure each
+    # message falls back to its own _search below.
+    try:
+        prefetch_pools([
+            (p.get("cuisine") or "").strip().lower()
+            for p in payloads if isinstance(p, dict)
+        ])
+    except Exception as e:
+        logging.error("OpenSearch _msearch failed: %s", e)
+
+    # Each message is IO-bound (OpenSearch on a cache miss), so overlap them.
+    # boto3 clients and the httpx client are shared and thread-safe.
+    with ThreadPoolExecutor(max_workers=len(msgs)) as ex:
+        results = list(ex.map(_safe_process, msgs, payloads))
+
+    # A message that needs an email is only done once SES accepts it
+    to_send = [(i, e) for i, (_, ok, e) in enumerate(results) if ok and e]
+    sent = send_bulk_emails([e for _, e in to_send]) if to_send else []
+    done = {i for i, (_, ok, e) in enumerate(results) if ok and not e}
+    done.update(i for (i, _), ok in zip(to_send, sent) if ok)
+
+    entries = [
+        {"Id": str(i), "ReceiptHandle": results[i][0]["ReceiptHandle"]}
+        for i in sorted(done)
+    ]
+
+    # One DeleteMessageBatch call (max 10 entries, same as MaxNumberOfMessages)
+    processed = 0
+    if entries:
+        res = sqs.delete_message_batch(QueueUrl=QUEUE_URL, Entries=entries)
+        processed = len(res.get("Successful", []))
+        for f in res.get("Failed", []):
+            logging.error("Delete failed for %s: %s", f.get("Id"), f.get("Message"))
+    return {"ok": True, "processed": processed}